@@ -1,5 +1,5 @@
 import argparse
-import pdb  # noqa
+import operator
 import sys
 from typing import Dict, Iterator
 
@@ -11,34 +11,46 @@ from lib import control_flow_graph
 
 from dataflow import solve_dataflow, dump_df_turnt
 
-
-def resolve_op(op, args):
-    return RESOLVABLE_OPS[op](*args)
+# Sentinel for variables without a known constant value
+_NOT_CONST = object()
 
 
 def constant_folding_and_propogation(instrs):
-    cfg = control_flow_graph.construct_cfg(instrs)
+    # The block only cfg is what gets rewritten, the full cfg built from it is what gets analyzed
+    block_cfg = control_flow_graph.construct_cfg(instrs, block_only=True)
+    cfg = control_flow_graph.complete_cfg(block_cfg)
+    # Bound once so every instruction costs a single lookup to find the function that folds it
+    get_fold_fn = RESOLVABLE_OPS.get
     # We construct the dataflow problem
 
     # Transfer function performs a local constant folding analysis (?)
     def transfer_fn(in_fact: Dict, block):
-        out_fact = in_fact.copy()
+        # in_fact is only copied once the block writes to it
+        # Blocks that don't define any constants hand back the same fact object, so they share it
+        out_fact = in_fact
         for instr in block:
             instr_op = instr["op"]
-            args = instr.get("args", [])
+            fold_fn = get_fold_fn(instr_op)
             # If this is a constant assignment, we can add it to our fact set
             if instr_op == "const":
+                if out_fact is in_fact:
+                    out_fact = in_fact.copy()
                 out_fact[instr["dest"]] = instr["value"]
             # Check if this is an effect operation
             # If dest exists, we know this must be a value op
-            elif instr_op in RESOLVABLE_OPS:
+            elif fold_fn is not None:
                 # If all of the arguments are constants, we can compute the op and store the constant value
-                all_args_are_const = all(arg in out_fact for arg in instr["args"])
-                if all_args_are_const:
+                # The args are resolved in the same pass, stopping at the first one that isn't a constant
+                args = []
+                for arg in instr["args"]:
+                    value = out_fact.get(arg, _NOT_CONST)
+                    if value is _NOT_CONST:
+                        break
+                    args.append(value)
+                else:
                     # All args are constants
-                    # Resolve the args and compute the op
-                    args = [out_fact[arg] for arg in instr["args"]]
-                    resolved_output = resolve_op(instr_op, args)
+                    # Compute the op on the resolved args
+                    resolved_output = fold_fn(*args)
                     # Transform this instruction into a constant assignment
                     instr["op"] = "const"
                     instr["value"] = resolved_output
@@ -46,6 +58,8 @@ def constant_folding_and_propogation(instrs):
                     # type is the same
                     del instr["args"]  # No long have args in the const instruction case
                     # Since we now know the resolved dest, we restore
+                    if out_fact is in_fact:
+                        out_fact = in_fact.copy()
                     out_fact[instr["dest"]] = resolved_output
             else:
                 # We are in the case of an effect operation or conditional
@@ -53,6 +67,15 @@ def constant_folding_and_propogation(instrs):
                 pass
         return out_fact
 
+    # Blocks without constants or foldable ops never change the fact, so the solver can skip them
+    identity_blocks = {
+        block_key
+        for block_key, block in cfg.block_map.items()
+        if not any(
+            instr["op"] == "const" or instr["op"] in RESOLVABLE_OPS for instr in block
+        )
+    }
+
     # Meet function is the intersection, If we don't know what a constant is (differing values), we remove it
     def meet_fn(in_facts: Iterator[Dict]):
         # We need to init so we grab the first element
@@ -65,22 +88,23 @@ def constant_folding_and_propogation(instrs):
             out_fact = {k: v for k, v in out_fact.items() if k in fact and v == fact[k]}
         return out_fact
 
-    in_facts, out_facts = solve_dataflow(
+    in_facts, recompute_out = solve_dataflow(
         cfg,
-        empty_fact_fn=lambda: dict(),  # Empty fact for constant folding is a mapping from var -> value
+        empty_fact_fn=dict,  # Empty fact for constant folding is a mapping from var -> value
         transfer_fn=transfer_fn,
         meet_fn=meet_fn,
-        fact_equality_checker=lambda x, y: x == y,  # Equality checker for dicts
+        fact_equality_checker=operator.eq,  # Equality checker for dicts
         mode="forward",
+        identity_blocks=identity_blocks,
     )
 
     # We now know all constants defined before and after a block
     # We propogate
-    cfg = control_flow_graph.construct_cfg(instrs, block_only=True)
-    for block_key, block in cfg.block_map.items():
+    # The block only cfg shares its instructions with the analyzed cfg, without the instructions we added
+    for block_key, block in block_cfg.block_map.items():
         transfer_fn(in_facts[block_key], block)
 
-    return in_facts, out_facts, control_flow_graph.reassemble(cfg)
+    return in_facts, recompute_out, control_flow_graph.reassemble(block_cfg)
 
 
 if __name__ == "__main__":
@@ -88,7 +112,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--debug",
         action="store_true",
-        help="Reads from a program from `prog.json` and starts pdb at inserted lines.",
+        help="Reads from a program from `prog.json` so `breakpoint()` calls can be added for debugging.",
     )
     parser.add_argument(
         "--turnt",
@@ -99,8 +123,12 @@ if __name__ == "__main__":
     prog = utils.load_bril("prog.json") if args.debug else utils.load_bril()
     # do something
     for f in prog["functions"]:
-        in_facts, out_facts, f["instrs"] = constant_folding_and_propogation(f["instrs"])
+        in_facts, recompute_out, f["instrs"] = constant_folding_and_propogation(
+            f["instrs"]
+        )
         if args.turnt:
+            # Out facts are only needed for the dump, so materialize them here
+            out_facts = {block_key: recompute_out(block_key) for block_key in in_facts}
             dump_df_turnt(in_facts, out_facts)
 
     if not args.turnt:
@@ -1,9 +1,10 @@
 import sys
 
 sys.path.append("../../assignments/")
-from collections import defaultdict
-from typing import Any, Callable, Dict, Iterator, List, Literal
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Set
 
+from lib.control_flow_graph import reverse_postorder
 from lib.types import ControlFlowGraph
 
 # "Fact" can be anything, but the join and meet functions need to defined on the same type
@@ -13,13 +14,29 @@ Empty_Fact_Fn_T = Callable[[], Fact_T]
 # Block is a list of instrs
 Block_T = List[Dict]
 # Transfer function - takes in the facts from the beginning / end of the block, the block, and computes the new facts
-Transfer_fn_T = Callable[[Fact_T, Block_T], Fact_T]
+# With include_block_name, the name of the block is passed as a third argument
+Transfer_fn_T = Callable[..., Fact_T]
 # Meet / join function should take in a list of facts and return a single fact that represents the meet / join of all the facts
 Meet_fn_T = Callable[[Iterator[Fact_T]], Fact_T]
 # Given two facts, return True if they are the same
 Fact_Equality_Checker_T = Callable[[Fact_T, Fact_T], bool]
 
 
+def _block_transfer(cfg, transfer_fn, include_block_name, identity_blocks):
+    """Wrap transfer_fn into a callable taking a fact and a block name."""
+    identity_blocks = identity_blocks or frozenset()
+
+    def transfer(fact, block_key):
+        # Blocks that are known to pass their fact through don't need the transfer function at all
+        if block_key in identity_blocks:
+            return fact
+        if include_block_name:
+            return transfer_fn(fact, cfg.block_map[block_key], block_key)
+        return transfer_fn(fact, cfg.block_map[block_key])
+
+    return transfer
+
+
 # We can either have forward or backward dataflow analysis
 def forward_data_flow(
     cfg: ControlFlowGraph,
@@ -27,29 +44,56 @@ def forward_data_flow(
     transfer_fn: Transfer_fn_T,
     meet_fn: Meet_fn_T,
     fact_equality_checker: Fact_Equality_Checker_T,
+    include_block_name: bool = False,
+    identity_blocks: Optional[Set[str]] = None,
 ):
+    transfer = _block_transfer(cfg, transfer_fn, include_block_name, identity_blocks)
     # Initialize original facts
-    in_facts = defaultdict(empty_fact_fn)
-    out_facts = defaultdict(empty_fact_fn)
-
-    # Starting from the top since block_map is an ordered dict
-    worklist = list(cfg.block_map.keys())
-    while len(worklist) > 0:
-        block_key = worklist.pop(0)
-        block = cfg.block_map[block_key]
+    # Only in_facts are handed back to the caller, out_facts just feed the meet of the successors
+    # Every block gets its entry up front, so lookups never have to fall back to empty_fact_fn
+    # This also keeps the facts in block order rather than the order the blocks are visited in
+    in_facts = {block_key: empty_fact_fn() for block_key in cfg.block_map}
+    out_facts = {block_key: empty_fact_fn() for block_key in cfg.block_map}
+
+    # Visiting blocks in reverse postorder means most predecessors are done before a block is reached
+    order = reverse_postorder(cfg)
+    worklist = deque(order)
+    # Blocks currently in the worklist, so a block is never queued twice
+    pending = set(order)
+    # Bind everything the loop touches to locals, the loop body runs once per block visit
+    predecessors, successors = cfg.predecessors, cfg.successors
+    popleft, append = worklist.popleft, worklist.append
+    equal = fact_equality_checker
+    while worklist:
+        block_key = popleft()
+        pending.discard(block_key)
         # Meet inputs for the block
-        in_facts[block_key] = meet_fn(
-            out_facts[predecessor] for predecessor in cfg.predecessors[block_key]
-        )
+        block_preds = predecessors[block_key]
+        if len(block_preds) == 1:
+            # Straight line code, the meet of a single fact is the fact itself
+            in_fact = out_facts[block_preds[0]]
+        else:
+            in_fact = meet_fn(out_facts[predecessor] for predecessor in block_preds)
+        in_facts[block_key] = in_fact
 
         # Compute the new fact
-        new_out_fact = transfer_fn(in_facts[block_key], block)
+        new_out_fact = transfer(in_fact, block_key)
         # The fact is different than what we have
         # Add to worklist and update out[block]
-        if not fact_equality_checker(new_out_fact, out_facts[block_key]):
+        old_out_fact = out_facts[block_key]
+        # Transfer functions often hand back the fact object they were given, which needs no deep comparison
+        if new_out_fact is not old_out_fact and not equal(new_out_fact, old_out_fact):
             out_facts[block_key] = new_out_fact
-            worklist.extend(cfg.successors[block_key])
-    return in_facts, out_facts
+            for successor in successors[block_key]:
+                if successor not in pending:
+                    append(successor)
+                    pending.add(successor)
+
+    def recompute_out(block_key):
+        # Out facts are re-derived on demand instead of being kept around
+        return transfer(in_facts[block_key], block_key)
+
+    return in_facts, recompute_out
 
 
 def backward_data_flow(
@@ -58,33 +102,60 @@ def backward_data_flow(
     transfer_fn: Transfer_fn_T,
     meet_fn: Meet_fn_T,
     fact_equality_checker: Fact_Equality_Checker_T,
+    include_block_name: bool = False,
+    identity_blocks: Optional[Set[str]] = None,
 ):
+    transfer = _block_transfer(cfg, transfer_fn, include_block_name, identity_blocks)
     # Initialize original facts
-    in_facts = defaultdict(empty_fact_fn)
-    out_facts = defaultdict(empty_fact_fn)
-
-    # Starting worklist is the reverse of the block_map keys
-    # We reverse since we want to go bottom to top but ultimately the starting worklist doesn't matter
-    worklist = list(cfg.block_map.keys())
-    worklist.reverse()
-    while len(worklist) > 0:
-        block_key = worklist.pop(0)
-        block = cfg.block_map[block_key]
+    # The transfer function runs on out_facts here, so in_facts only feed the meet of the predecessors
+    # Every block gets its entry up front, so lookups never have to fall back to empty_fact_fn
+    # This also keeps the facts in block order rather than the order the blocks are visited in
+    in_facts = {block_key: empty_fact_fn() for block_key in cfg.block_map}
+    out_facts = {block_key: empty_fact_fn() for block_key in cfg.block_map}
+
+    # Starting worklist is the postorder of the blocks
+    # Going bottom to top means most successors are done before a block is reached
+    order = reverse_postorder(cfg)
+    order.reverse()
+    worklist = deque(order)
+    # Blocks currently in the worklist, so a block is never queued twice
+    pending = set(order)
+    # Bind everything the loop touches to locals, the loop body runs once per block visit
+    predecessors, successors = cfg.predecessors, cfg.successors
+    popleft, append = worklist.popleft, worklist.append
+    equal = fact_equality_checker
+    while worklist:
+        block_key = popleft()
+        pending.discard(block_key)
 
         # Meet the output facts of all the successors
         # We're going "bottom up"
-        out_facts[block_key] = meet_fn(
-            in_facts[successor] for successor in cfg.successors[block_key]
-        )
+        block_succs = successors[block_key]
+        if len(block_succs) == 1:
+            # Straight line code, the meet of a single fact is the fact itself
+            out_fact = in_facts[block_succs[0]]
+        else:
+            out_fact = meet_fn(in_facts[successor] for successor in block_succs)
+        out_facts[block_key] = out_fact
 
         # Now compute the new in fact from the out_fact and block
-        new_in_fact = transfer_fn(out_facts[block_key], block)
+        new_in_fact = transfer(out_fact, block_key)
         # Check if the new in fact is different old one
-        if not fact_equality_checker(new_in_fact, in_facts[block_key]):
+        old_in_fact = in_facts[block_key]
+        # Transfer functions often hand back the fact object they were given, which needs no deep comparison
+        if new_in_fact is not old_in_fact and not equal(new_in_fact, old_in_fact):
             in_facts[block_key] = new_in_fact
             # Add all of the predecessors to the worklist since their out facts will change
-            worklist.extend(cfg.predecessors[block_key])
-    return in_facts, out_facts
+            for predecessor in predecessors[block_key]:
+                if predecessor not in pending:
+                    append(predecessor)
+                    pending.add(predecessor)
+
+    def recompute_in(block_key):
+        # In facts are re-derived on demand instead of being kept around
+        return transfer(out_facts[block_key], block_key)
+
+    return out_facts, recompute_in
 
 
 def solve_dataflow(
@@ -94,6 +165,8 @@ def solve_dataflow(
     meet_fn: Meet_fn_T,
     fact_equality_checker: Fact_Equality_Checker_T,
     mode: Literal["forward", "backward"],
+    include_block_name: bool = False,
+    identity_blocks: Optional[Set[str]] = None,
 ):
     """
     Solve the dataflow problem.
@@ -102,16 +175,38 @@ def solve_dataflow(
         empty_fact_fn (Empty_Fact_Fn_T): Callable factory that should return an empty fact. Takes no args.
         transfer_fn (Transfer_fn_T): Callable that takes in a Fact and Block of instructions, returning the corresponding computed fact.
         meet_fn (Meet_fn_T): Callable that takes in an iterable of facts and joins / meets them.
+            Facts are never mutated in place by the solver, so meet_fn may return one of its inputs as is.
+            The meet of a single fact must be that fact, blocks with one predecessor (successor for 'backward')
+            take it directly without calling meet_fn.
         fact_equality_checker (Fact_Equality_Checker_T): Callable that returns true if two facts are equivalent
         mode (string): Either 'forward' or 'backward'.
+        include_block_name (bool): If set, transfer_fn is also passed the name of the block as a third argument.
+            Useful for looking up per-block data that is computed once before solving.
+        identity_blocks (Set[str], optional): Names of blocks whose transfer function returns its input unchanged.
+            The solver passes their facts straight through without calling transfer_fn.
+    returns:
+        A tuple of the facts fed into each block's transfer function (the in facts for 'forward', the out facts for
+        'backward') and a callable taking a block name that re-derives the other side by running transfer_fn.
     """
     if mode == "forward":
         return forward_data_flow(
-            cfg, empty_fact_fn, transfer_fn, meet_fn, fact_equality_checker
+            cfg,
+            empty_fact_fn,
+            transfer_fn,
+            meet_fn,
+            fact_equality_checker,
+            include_block_name,
+            identity_blocks,
         )
     elif mode == "backward":
         return backward_data_flow(
-            cfg, empty_fact_fn, transfer_fn, meet_fn, fact_equality_checker
+            cfg,
+            empty_fact_fn,
+            transfer_fn,
+            meet_fn,
+            fact_equality_checker,
+            include_block_name,
+            identity_blocks,
         )
     else:
         raise ValueError("Mode should be either 'forward' or 'backward'")
@@ -1,4 +1,5 @@
 import sys
+from collections import Counter, defaultdict, deque
 
 # Get lib
 sys.path.append("../../assignments/")
@@ -10,29 +11,30 @@ def is_pure_instr(instr):
     return "dest" in instr
 
 
-def _trivial_deadcode_elimination(instrs):
-    used_vars = set()
-    for instr in instrs:
-        for arg in instr.get("args", []):
-            used_vars.add(arg)
-
-    new_instrs = []
-    modified = False
-    for instr in instrs:
-        if instr.get("dest") not in used_vars and is_pure_instr(instr):
-            # We removed an instruction so set modified to true
-            modified = True
-        else:
-            # Otherwise, we need to keep the instruction
-            new_instrs.append(instr)
-    return new_instrs, modified
-
-
 def trivial_deadcode_elimination(instrs):
-    modified = True
-    while modified:
-        instrs, modified = _trivial_deadcode_elimination(instrs)
-    return instrs
+    # Count how often every variable is used and remember which pure instructions define it
+    use_count = Counter(arg for instr in instrs for arg in instr.get("args", []))
+    pure_defs = defaultdict(list)
+    for idx, instr in enumerate(instrs):
+        if is_pure_instr(instr):
+            pure_defs[instr["dest"]].append(idx)
+
+    # Start from the pure instructions whose dest is never used
+    dead = deque(
+        idx
+        for idx, instr in enumerate(instrs)
+        if is_pure_instr(instr) and use_count[instr["dest"]] == 0
+    )
+    removed = bytearray(len(instrs))
+    while dead:
+        idx = dead.popleft()
+        removed[idx] = 1
+        # Removing an instruction drops its uses, which can make other definitions dead
+        for arg in instrs[idx].get("args", []):
+            use_count[arg] -= 1
+            if use_count[arg] == 0:
+                dead.extend(pure_defs.get(arg, ()))
+    return [instr for idx, instr in enumerate(instrs) if not removed[idx]]
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import argparse
-import pdb  # noqa
+import operator
 import sys
+from functools import reduce
 from typing import Dict, Iterator, Set  # noqa
 
 # Get lib
@@ -9,97 +10,127 @@ from dataflow import dump_df_turnt, solve_dataflow  # noqa
 from lib import control_flow_graph, utils
 
 
-def deadcode_elimination_liveness(in_facts: Set, out_facts: Set, block):
-    # in_facts: unused
-    idx_marked_for_deletion = []
+def deadcode_elimination_liveness(out_facts: Set, block):
+    # Instructions are marked while walking the block and the block is rebuilt once at the end
+    # This avoids shifting the rest of the list for every deleted instruction
+    keep = bytearray(b"\x01" * len(block))
+    modified = False
     # The live variables start out as out_facts
     live_vars = out_facts.copy()
     # We traverse the block in reverse order
     for idx in range(len(block) - 1, -1, -1):
         instr = block[idx]
         dest = instr.get("dest", None)
-        args = instr.get("args", [])
-        marked_for_deletion = False
         if dest is not None:
             # There is no assignment and we can not delete this line
             # Check if dest is live. If not, delete this line
             if dest not in live_vars:
-                idx_marked_for_deletion.append(idx)
-                marked_for_deletion = True
+                keep[idx] = 0
+                modified = True
+                continue
         # If this line is not marked for deletion, add the args of it to live variables
-        if not marked_for_deletion:
-            for arg in args:
-                live_vars.add(arg)
-    for idx in sorted(idx_marked_for_deletion, reverse=True):
-        del block[idx]
-    return len(idx_marked_for_deletion) > 0
+        for arg in instr.get("args", []):
+            live_vars.add(arg)
+    if modified:
+        # In place so the block in the cfg is updated
+        block[:] = [instr for instr, kept in zip(block, keep) if kept]
+    return modified
 
 
 def global_liveness(instrs):
-    cfg = control_flow_graph.construct_cfg(instrs)
+    # The block only cfg is what gets rewritten, the full cfg built from it is what gets analyzed
+    block_cfg = control_flow_graph.construct_cfg(instrs, block_only=True)
+    cfg = control_flow_graph.complete_cfg(block_cfg)
 
     # We run a backward dataflow analysis
-    # At the start, no variables are live so init to empty set
-    def empty_fact_fn():
-        return set()
-
-    def gen(block):
-        # Gen function returns the set of variables that are used in a block
-        # These are "live variables"
-        redefined_vars = set()
+    def gen_kill(block):
+        # Computes gen and kill of a block in a single walk over its instructions
+        # gen is the set of variables that are used in a block before being redefined, these are "live variables"
+        # kill is the set of variables that are defined in a block
+        # These variables are not considered live since they're essentially new variables, akin to being renamed
         used_vars = set()
+        defined_vars = set()
         for instr in block:
-            args = instr.get("args", [])
-            for arg in args:
+            for arg in instr.get("args", []):
                 # If arg has been defined in the block, we don't count it as an instance of the prev var being live
                 # Since we are only concerned with incoming liveness
-                if arg not in redefined_vars:
+                if arg not in defined_vars:
                     used_vars.add(arg)
             dest = instr.get("dest", None)
-            if dest is not None:
-                redefined_vars.add(dest)
-        return used_vars
-
-    def kill(block):
-        # kill function returns the set of variables that are defined in a block
-        # These variables are not considered live since they're essentially new variables, akin to being renamed
-        defined_vars = set()
-        for instr in block:
-            dest = instr.get("dest", None)
             if dest is not None:
                 defined_vars.add(dest)
-        return defined_vars
+        return used_vars, defined_vars
+
+    # Blocks don't change while solving, so gen and kill are computed once per block instead of on every visit
+    gen_sets = {}
+    kill_sets = {}
+    for block_key, block in cfg.block_map.items():
+        gen_sets[block_key], kill_sets[block_key] = gen_kill(block)
+
+    # Facts are bitsets over the variables of the function, stored as python ints
+    # Bit i is set if variable var_names[i] is live
+    var_names = sorted(set().union(*gen_sets.values(), *kill_sets.values()))
+    var_bits = {var: 1 << idx for idx, var in enumerate(var_names)}
+
+    def to_mask(var_set):
+        mask = 0
+        for var in var_set:
+            mask |= var_bits[var]
+        return mask
+
+    def to_set(mask):
+        live_vars = set()
+        while mask:
+            # Peel off the lowest set bit
+            low_bit = mask & -mask
+            live_vars.add(var_names[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return live_vars
+
+    gen_masks = {block_key: to_mask(used) for block_key, used in gen_sets.items()}
+    kill_masks = {
+        block_key: to_mask(defined) for block_key, defined in kill_sets.items()
+    }
 
-    def transfer_fn(out_facts, block):
+    # Blocks that neither use nor define anything pass out(b) through unchanged
+    identity_blocks = {
+        block_key
+        for block_key in cfg.block_map
+        if not gen_masks[block_key] and not kill_masks[block_key]
+    }
+
+    def transfer_fn(out_facts, block, block_key):
         # The transfer function is simply in(b) = gen(b) U (out(b) - kill(b))
-        return gen(block).union(out_facts - kill(block))
+        return gen_masks[block_key] | (out_facts & ~kill_masks[block_key])
 
-    # Meet function is set union
-    def meet_fn(facts: Iterator[Dict]):
-        new_fact = empty_fact_fn()
-        for fact in facts:
-            new_fact = new_fact.union(fact)
-        return new_fact
+    # Meet function is set union, which is a bitwise or on the masks
+    def meet_fn(facts: Iterator[int]):
+        return reduce(operator.or_, facts, 0)
 
-    in_facts, out_facts = solve_dataflow(
+    out_masks, recompute_in_mask = solve_dataflow(
         cfg,
-        empty_fact_fn=empty_fact_fn,
+        # No variables are live at the start
+        empty_fact_fn=int,
         transfer_fn=transfer_fn,
         meet_fn=meet_fn,
-        # Set equality checker
-        fact_equality_checker=lambda x, y: x == y,
+        fact_equality_checker=operator.eq,
         mode="backward",
+        include_block_name=True,
+        identity_blocks=identity_blocks,
     )
-    # Now that we have the in_facts, out_facts, we perform deadcode elimination
-    # We create a new cfg so we can get rid of any instructions we added during control graph creation
-    cfg = control_flow_graph.construct_cfg(instrs, block_only=True)
-    for block_key, block in cfg.block_map.items():
+    # Callers get plain sets of variable names back
+    out_facts = {block_key: to_set(mask) for block_key, mask in out_masks.items()}
+
+    def recompute_in(block_key):
+        return to_set(recompute_in_mask(block_key))
+
+    # Now that we have the out_facts, we perform deadcode elimination
+    # We use the block only cfg so we get rid of any instructions we added during control graph creation
+    for block_key, block in block_cfg.block_map.items():
         # In place updates
-        deadcode_elimination_liveness(
-            in_facts=in_facts[block_key], out_facts=out_facts[block_key], block=block
-        )
+        deadcode_elimination_liveness(out_facts=out_facts[block_key], block=block)
 
-    return in_facts, out_facts, control_flow_graph.reassemble(cfg)
+    return out_facts, recompute_in, control_flow_graph.reassemble(block_cfg)
 
 
 if __name__ == "__main__":
@@ -107,7 +138,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--debug",
         action="store_true",
-        help="Reads from a program from `prog.json` and starts pdb at inserted lines.",
+        help="Reads from a program from `prog.json` so `breakpoint()` calls can be added for debugging.",
     )
     parser.add_argument(
         "--turnt",
@@ -118,8 +149,10 @@ if __name__ == "__main__":
     prog = utils.load_bril("prog.json") if args.debug else utils.load_bril()
     # do something
     for f in prog["functions"]:
-        in_facts, out_facts, f["instrs"] = global_liveness(f["instrs"])
+        out_facts, recompute_in, f["instrs"] = global_liveness(f["instrs"])
         if args.turnt:
+            # In facts are only needed for the dump, so materialize them here
+            in_facts = {block_key: recompute_in(block_key) for block_key in out_facts}
             dump_df_turnt(in_facts, out_facts)
 
     if not args.turnt:
@@ -1,7 +1,5 @@
-from collections import OrderedDict
-
 from .types import TERMINATOR_OPS, ControlFlowGraph
-from .utils import flatten, fresh
+from .utils import fresh, fresh_names
 
 
 def construct_cfg(instrs, block_only: bool = False) -> ControlFlowGraph:
@@ -11,12 +9,21 @@ def construct_cfg(instrs, block_only: bool = False) -> ControlFlowGraph:
     Returns a tuple of the block map, predecessors, and successors.
         - Block map is ordered such that iterating the keys will yield the order in which blocks were generated.
     """
-    # Form the initial blocks
-    blocks = form_blocks(instrs)
-    # Generate the block mapping
-    block_map = generate_block_map(blocks)
+    # Form and name the blocks in one pass
+    block_map = form_block_map(instrs)
+    cfg = ControlFlowGraph(block_map=block_map, predecessors=None, successors=None)
     if block_only:
-        return ControlFlowGraph(block_map=block_map, predecessors=None, successors=None)
+        return cfg
+    return complete_cfg(cfg)
+
+
+def complete_cfg(cfg: ControlFlowGraph) -> ControlFlowGraph:
+    """Given a block only CFG, generates the full control flow graph over the same instructions.
+    The blocks are copied before terminators and the entry block are added, so the block only CFG is left untouched.
+    Both CFGs share the instruction dicts, which lets a pass analyze the full CFG and rewrite the block only one
+    without forming the blocks twice.
+    """
+    block_map = {name: list(block) for name, block in cfg.block_map.items()}
     # Add terminators to all blocks
     add_terminators(block_map)
     # Ensure that there is an entry to the CFG
@@ -26,66 +33,99 @@ def construct_cfg(instrs, block_only: bool = False) -> ControlFlowGraph:
     return ControlFlowGraph(block_map=block_map, predecessors=preds, successors=succs)
 
 
-def generate_block_map(blocks):
-    """Given a sequence of basic blocks, which are lists of instructions,
-    produce a `OrderedDict` mapping names to blocks.
+def form_block_map(instrs):
+    """Given a list of Bril instructions, form the basic blocks and
+    produce a `dict` mapping names to blocks, in the order the blocks appear.
 
+    This is `form_blocks` and naming the blocks fused into a single pass
+    over the instructions.
     The name of the block comes from the label it starts with, if any.
     Anonymous blocks, which don't start with a label, get an
     automatically generated name. Blocks in the mapping have their
     labels removed.
     """
-    by_name = OrderedDict()
-
-    for block in blocks:
-        # Generate a name for the block.
-        if "label" in block[0]:
-            # The block has a label. Remove the label but use it for the
-            # block's name.
-            name = block[0]["label"]
-            block = block[1:]
-        else:
-            # Make up a new name for this anonymous block.
-            name = fresh("b", by_name)
+    by_name = {}
+    # A single generator hands out all anonymous names, so each one doesn't probe from b1 again
+    anonymous_names = fresh_names("b", by_name)
 
-        # Add the block to the mapping.
+    def add_block(label, block):
+        # Make up a new name for anonymous blocks.
+        name = label if label is not None else next(anonymous_names)
         by_name[name] = block
 
+    # Label of the block being formed, if it started with one.
+    cur_label = None
+    cur_block = []
+
+    for instr in instrs:
+        if "op" in instr:  # It's an instruction.
+            cur_block.append(instr)
+
+            # A terminator is the last instruction in the block.
+            if instr["op"] in TERMINATOR_OPS:
+                add_block(cur_label, cur_block)
+                cur_label = None
+                cur_block = []
+
+        else:  # It's a label.
+            # End the block here (if it contains anything).
+            if cur_label is not None or cur_block:
+                add_block(cur_label, cur_block)
+
+            # Start a new block with the label, which is not kept in the block.
+            cur_label = instr["label"]
+            cur_block = []
+
+    # Add the final block, if any.
+    if cur_label is not None or cur_block:
+        add_block(cur_label, cur_block)
+
     return by_name
 
 
+# Jump targets of each terminator op, looked up once per terminator instead of comparing against every op
+_TERMINATOR_SUCCESSORS = {
+    "jmp": lambda instr: instr["labels"],
+    "br": lambda instr: instr["labels"],
+    "ret": lambda instr: [],  # No successors to an exit block.
+}
+
+
 def successors(instr):
     """Get the list of jump target labels for an instruction.
 
     Raises a ValueError if the instruction is not a terminator (jump,
     branch, or return).
     """
-    if instr["op"] in ("jmp", "br"):
-        return instr["labels"]
-    elif instr["op"] == "ret":
-        return []  # No successors to an exit block.
-    else:
-        raise ValueError("{} is not a terminator".format(instr["op"]))
+    op = instr["op"]
+    try:
+        targets = _TERMINATOR_SUCCESSORS[op]
+    except KeyError:
+        raise ValueError("{} is not a terminator".format(op)) from None
+    return targets(instr)
 
 
 def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
-    for i, block in enumerate(blocks.values()):
+    # Computed once, building the key list per block is quadratic in the number of blocks
+    names = list(blocks.keys())
+    for i, name in enumerate(names):
+        block = blocks[name]
         if not block:
-            if i == len(blocks) - 1:
+            if i == len(names) - 1:
                 # In the last block, return.
                 block.append({"op": "ret", "args": []})
             else:
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({"op": "jmp", "labels": [dest]})
         elif block[-1]["op"] not in TERMINATOR_OPS:
-            if i == len(blocks) - 1:
+            if i == len(names) - 1:
                 block.append({"op": "ret", "args": []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({"op": "jmp", "labels": [dest]})
 
 
@@ -99,7 +139,11 @@ def add_entry(blocks):
     first_lbl = next(iter(blocks.keys()))
 
     # Check for any references to the label.
-    for instr in flatten(blocks.values()):
+    # Only terminators carry labels and they always end a block, so looking at the last instruction is enough
+    for block in blocks.values():
+        if not block:
+            continue
+        instr = block[-1]
         if "labels" in instr and first_lbl in instr["labels"]:
             break
     else:
@@ -107,8 +151,12 @@ def add_entry(blocks):
 
     # References exist; insert a new block.
     new_lbl = fresh("entry", blocks)
+    # Plain dicts can't move a key to the front, so the mapping is rebuilt with the new block first
+    # This happens at most once per CFG
+    old_blocks = list(blocks.items())
+    blocks.clear()
     blocks[new_lbl] = []
-    blocks.move_to_end(new_lbl, last=False)
+    blocks.update(old_blocks)
 
 
 def edges(blocks):
@@ -125,6 +173,35 @@ def edges(blocks):
     return preds, succs
 
 
+def reverse_postorder(cfg: ControlFlowGraph):
+    """Order the blocks of a CFG in reverse postorder starting from the entry block.
+
+    The traversal uses an explicit stack so deep CFGs don't hit the recursion limit.
+    Blocks that are unreachable from the entry are appended at the end in block map order.
+    """
+    if not cfg.block_map:
+        return []
+    entry = next(iter(cfg.block_map.keys()))
+    visited = {entry}
+    postorder = []
+    stack = [(entry, iter(cfg.successors[entry]))]
+    while stack:
+        name, succs = stack[-1]
+        for succ in succs:
+            if succ not in visited:
+                # Descend into the first unvisited successor, we come back for the rest later
+                visited.add(succ)
+                stack.append((succ, iter(cfg.successors[succ])))
+                break
+        else:
+            # All successors are done so the block can be emitted
+            stack.pop()
+            postorder.append(name)
+    postorder.reverse()
+    postorder.extend(name for name in cfg.block_map if name not in visited)
+    return postorder
+
+
 def reassemble(cfg: ControlFlowGraph):
     """Flatten a CFG into an instruction list."""
     # This could optimize slightly by opportunistically eliminating
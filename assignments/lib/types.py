@@ -1,11 +1,14 @@
-from collections import OrderedDict
+import operator
 from dataclasses import dataclass
 from typing import Dict, List
 
 
 @dataclass
 class ControlFlowGraph:
-    block_map: OrderedDict[str, List[Dict]]
+    # No per instance __dict__, the solvers read these attributes constantly
+    __slots__ = ("block_map", "predecessors", "successors")
+
+    block_map: Dict[str, List[Dict]]
     predecessors: Dict[str, List[str]]
     successors: Dict[str, List[str]]
 
@@ -15,17 +18,19 @@ TERMINATOR_OPS = "br", "jmp", "ret"
 
 
 # Constant operations that are resolvable
+# The operator module versions are implemented in C, so folding doesn't go through a python frame
 RESOLVABLE_OPS = {
-    "add": lambda x, y: x + y,
-    "mul": lambda x, y: x * y,
-    "sub": lambda x, y: x - y,
-    "div": lambda x, y: x / y,
-    "eq": lambda x, y: x == y,
-    "lt": lambda x, y: x < y,
-    "gt": lambda x, y: x > y,
-    "le": lambda x, y: x <= y,
-    "ge": lambda x, y: x >= y,
-    "not": lambda x: not x,
+    "add": operator.add,
+    "mul": operator.mul,
+    "sub": operator.sub,
+    "div": operator.truediv,
+    "eq": operator.eq,
+    "lt": operator.lt,
+    "gt": operator.gt,
+    "le": operator.le,
+    "ge": operator.ge,
+    "not": operator.not_,
+    # operator.and_ and operator.or_ are bitwise, so the logical ones stay lambdas
     "and": lambda x, y: x and y,
     "or": lambda x, y: x or y,
 }
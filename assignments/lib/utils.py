@@ -44,3 +44,18 @@ def fresh(seed, names):
         if name not in names:
             return name
         i += 1
+
+
+def fresh_names(seed, names):
+    """Generate new names that are not in `names` starting with `seed`.
+
+    Like repeated calls to `fresh`, but the counter carries over between
+    names instead of starting from 1 every time. `names` is checked when
+    each name is drawn, so it may grow in between.
+    """
+    i = 1
+    while True:
+        name = seed + str(i)
+        if name not in names:
+            yield name
+        i += 1
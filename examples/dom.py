@@ -37,37 +37,68 @@ def postorder(succ, root):
     return out
 
 
-def intersect(sets):
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
-    return out
-
-
-def get_dom(succ, entry):
+def get_idom(succ, entry):
+    """Compute the immediate dominator of every node reachable from
+    `entry`, using the algorithm from Cooper, Harvey, and Kennedy's "A
+    Simple, Fast Dominance Algorithm." The entry is its own immediate
+    dominator.
+    """
     pred = map_inv(succ)
     nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
-
-    dom = {v: set(nodes) for v in succ}
-
+    rpo_index = {v: i for i, v in enumerate(nodes)}
+
+    def intersect_idom(a, b):
+        # Walk both nodes up the dominator tree until they meet.
+        while a != b:
+            while rpo_index[a] > rpo_index[b]:
+                a = idom[a]
+            while rpo_index[b] > rpo_index[a]:
+                b = idom[b]
+        return a
+
+    idom = {entry: entry}
     while True:
         changed = False
 
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
-
-            if dom[node] != new_dom:
-                dom[node] = new_dom
+        for node in nodes[1:]:
+            new_idom = None
+            for p in pred[node]:
+                # Skip predecessors that have not been processed yet.
+                if p not in idom:
+                    continue
+                if new_idom is None:
+                    new_idom = p
+                else:
+                    new_idom = intersect_idom(p, new_idom)
+
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
                 changed = True
 
         if not changed:
             break
 
-    return dom
+    return idom, nodes
+
+
+def get_dom(succ, entry):
+    idom, nodes = get_idom(succ, entry)
+
+    # Walking in reverse postorder means a node's immediate dominator is
+    # always done before the node itself.
+    reachable_dom = {}
+    for node in nodes:
+        if node == entry:
+            reachable_dom[node] = {node}
+        else:
+            reachable_dom[node] = reachable_dom[idom[node]] | {node}
+
+    # Unreachable nodes are never constrained, so they keep the initial
+    # "dominated by everything" value.
+    return {
+        v: reachable_dom[v] if v in reachable_dom else set(nodes)
+        for v in succ
+    }
 
 
 def dom_fronts(dom, succ):
@@ -21,26 +21,31 @@ def normalize():
     # Read input CSV.
     reader = csv.DictReader(sys.stdin)
     in_data = list(reader)
+    # Parse every result once, up front.
+    results = [try_parse(row["result"]) for row in in_data]
 
     # Get normalization baselines.
     baselines = {
-        row["benchmark"]: try_parse(row["result"])
-        for row in in_data
-        if row["run"] == "baseline" and try_parse(row["result"])
+        row["benchmark"]: res
+        for row, res in zip(in_data, results)
+        if row["run"] == "baseline" and res
     }
 
-    # Write output CSV back out.
-    writer = csv.DictWriter(sys.stdout, reader.fieldnames)
-    writer.writeheader()
+    # Compute the normalized rows.
     ratios = defaultdict(list)
-    for row in in_data:
-        res = try_parse(row["result"])
+    out_data = []
+    for row, res in zip(in_data, results):
         if res is None:
             continue
-        ratio = int(row["result"]) / baselines[row["benchmark"]]
+        ratio = res / baselines[row["benchmark"]]
         ratios[row["run"]].append(ratio)
         row["result"] = ratio
-        writer.writerow(row)
+        out_data.append(row)
+
+    # Write output CSV back out.
+    writer = csv.DictWriter(sys.stdout, reader.fieldnames)
+    writer.writeheader()
+    writer.writerows(out_data)
 
     # Print stats.
     for run, rs in ratios.items():
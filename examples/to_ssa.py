@@ -28,63 +28,72 @@ def get_phis(blocks, df, defs):
     phis = {b: set() for b in blocks}
     for v, v_defs in defs.items():
         v_defs_list = list(v_defs)
+        # Same blocks as `v_defs_list`, for constant-time membership tests.
+        v_defs_set = set(v_defs_list)
         for d in v_defs_list:
             for block in df[d]:
                 # Add a phi-node...
-                if v not in phis[block]:
+                block_phis = phis[block]
+                if v not in block_phis:
                     # ..unless we already did.
-                    phis[block].add(v)
-                    if block not in v_defs_list:
+                    block_phis.add(v)
+                    if block not in v_defs_set:
                         v_defs_list.append(block)
+                        v_defs_set.add(block)
     return phis
 
 
 def ssa_rename(blocks, phis, succ, domtree, args):
+    # The current name of each variable is at the end of its stack.
     stack = defaultdict(list, {v: [v] for v in args})
     phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        # Variables pushed in this block, so they can be popped at the end.
+        pushed = []
 
         # Rename phi-node destinations.
+        block_phi_dests = phi_dests[block]
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            block_phi_dests[p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
+            succ_phi_args = phi_args[s]
             for p in phis[s]:
-                if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                p_stack = stack[p]
+                if p_stack:
+                    succ_phi_args[p].append((block, p_stack[-1]))
                 else:
                     # The variable is not defined on this path
-                    phi_args[s][p].append((block, "__undefined"))
+                    succ_phi_args[p].append((block, "__undefined"))
 
         # Recursive calls.
         for b in sorted(domtree[block]):
             _rename(b)
 
         # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
+        for var in pushed:
+            stack[var].pop()
 
     entry = list(blocks.keys())[0]
     _rename(entry)